@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
 
 
 class BaseStore(ABC):
@@ -6,8 +7,8 @@ class BaseStore(ABC):
 
     @property
     @abstractmethod
-    def store(self) -> dict:
-        """Returns the in-memory store"""
+    def store(self) -> MutableMapping:
+        """Returns the in-memory store, a dict or another mutable mapping"""
         pass
     @abstractmethod
     def set_log_file_path(self, file_path: str) -> None:
@@ -37,3 +38,14 @@ class BaseStore(ABC):
         """Recover state from log file"""
         pass
 
+    @abstractmethod
+    def close(self) -> None:
+        """Flush pending writes and release the store's resources"""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
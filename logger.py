@@ -11,17 +11,17 @@ class Logger:
             filemode="a",
             format="%(asctime)s [%(levelname)s] %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
-            level=logging.DEBUG
+            level=logging.WARNING
         )
         self.logger = logging.getLogger("AppLogger")
 
-    def log(self, message):
-        self.logger.debug(message)   # general log
+    def log(self, message, *args):
+        self.logger.debug(message, *args)   # general log
 
-    def info(self, message):
-        self.logger.info(message)
+    def info(self, message, *args):
+        self.logger.info(message, *args)
 
-    def error(self, message):
-        self.logger.error(message)
-    def warning(self, message):
-        self.logger.warning(message)
\ No newline at end of file
+    def error(self, message, *args):
+        self.logger.error(message, *args)
+    def warning(self, message, *args):
+        self.logger.warning(message, *args)
\ No newline at end of file
@@ -0,0 +1,80 @@
+from array import array
+from collections.abc import MutableMapping
+
+_MISSING = object()
+
+
+class OffsetTable(MutableMapping):
+    """
+    Structure-of-arrays table mapping keys to record offsets.
+
+    - A dict maps each key to a slot; the slot's key and offset live in a list and in a
+      contiguous array('Q') of unboxed 64-bit offsets.
+    - A MutableMapping; get, [], pop, del, in, len and items are implemented directly, the rest of the
+      mapping methods (keys, values, update, ...) come from the abstract base class.
+    - Slots freed by pop or del are reused by later insertions.
+    - items() walks the slot arrays in order, so a full scan reads the offsets sequentially.
+    """
+
+    def __init__(self):
+        self.__index = {}
+        self.__keys = []
+        self.__offsets = array("Q")
+        self.__free_slots = []
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __contains__(self, key):
+        return key in self.__index
+
+    def __iter__(self):
+        return iter(self.__index)
+
+    def __getitem__(self, key):
+        return self.__offsets[self.__index[key]]
+
+    def get(self, key, default=None):
+        """Return the offset stored for key, or default if the key is absent."""
+        slot = self.__index.get(key)
+        if slot is None:
+            return default
+        return self.__offsets[slot]
+
+    def __setitem__(self, key, offset):
+        slot = self.__index.get(key)
+        if slot is not None:
+            self.__offsets[slot] = offset
+        elif self.__free_slots:
+            slot = self.__free_slots.pop()
+            self.__keys[slot] = key
+            self.__offsets[slot] = offset
+            self.__index[key] = slot
+        else:
+            self.__index[key] = len(self.__keys)
+            self.__keys.append(key)
+            self.__offsets.append(offset)
+
+    def __delitem__(self, key):
+        self.__free(self.__index.pop(key))
+
+    def pop(self, key, default=_MISSING):
+        """Remove key and return its offset, or default if the key is absent (KeyError without a default)."""
+        slot = self.__index.pop(key, None)
+        if slot is None:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        self.__free(slot)
+        return self.__offsets[slot]
+
+    def __free(self, slot):
+        """Mark a slot as free, for reuse by a later insertion."""
+        self.__keys[slot] = None
+        self.__free_slots.append(slot)
+
+    def items(self):
+        """Yield (key, offset) pairs, scanning the slot arrays in order."""
+        for key, offset in zip(self.__keys, self.__offsets):
+            if key is not None:
+                yield key, offset
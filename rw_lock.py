@@ -0,0 +1,48 @@
+import threading
+
+
+class RWLock:
+    """
+    Readers-writer lock built on a single condition variable.
+
+    - Any number of readers can hold the lock at the same time.
+    - A writer holds it alone, once every active reader has released it.
+    - Writers are preferred: new readers wait while a writer is waiting, so a
+      steady stream of reads cannot starve a writer.
+    - The lock is not reentrant.
+    """
+
+    def __init__(self):
+        self.__cond = threading.Condition(threading.Lock())
+        self.__readers = 0
+        self.__writer = False
+        self.__writers_waiting = 0
+
+    def acquire_read(self):
+        """Acquire the lock for reading, waiting while a writer holds or waits for it."""
+        with self.__cond:
+            self.__cond.wait_for(lambda: not self.__writer and not self.__writers_waiting)
+            self.__readers += 1
+
+    def release_read(self):
+        """Release a read lock and wake up a waiting writer when the last reader leaves."""
+        with self.__cond:
+            self.__readers -= 1
+            if not self.__readers:
+                self.__cond.notify_all()
+
+    def acquire_write(self):
+        """Acquire the lock for writing, waiting until no reader or writer holds it."""
+        with self.__cond:
+            self.__writers_waiting += 1
+            try:
+                self.__cond.wait_for(lambda: not self.__writer and not self.__readers)
+            finally:
+                self.__writers_waiting -= 1
+            self.__writer = True
+
+    def release_write(self):
+        """Release the write lock and wake up every waiting reader and writer."""
+        with self.__cond:
+            self.__writer = False
+            self.__cond.notify_all()
@@ -0,0 +1,52 @@
+import unittest
+
+from offset_table import OffsetTable
+
+
+class OffsetTableTest(unittest.TestCase):
+
+    def test_mapping_operations(self):
+        table = OffsetTable()
+        table[b"a"] = 1
+        table[b"b"] = 2
+        table[b"a"] = 3
+        self.assertEqual(len(table), 2)
+        self.assertIn(b"a", table)
+        self.assertNotIn(b"c", table)
+        self.assertEqual(table[b"a"], 3)
+        self.assertEqual(table.get(b"c"), None)
+        self.assertEqual(sorted(table.keys()), [b"a", b"b"])
+        self.assertEqual(sorted(table.values()), [2, 3])
+        self.assertEqual(table.pop(b"c", None), None)
+        with self.assertRaises(KeyError):
+            table.pop(b"c")
+        with self.assertRaises(KeyError):
+            del table[b"c"]
+        with self.assertRaises(KeyError):
+            table[b"c"]
+
+    def test_freed_slots_are_reused(self):
+        table = OffsetTable()
+        for i in range(4):
+            table[bytes([i])] = i
+        self.assertEqual(table.pop(bytes([1])), 1)
+        del table[bytes([2])]
+        table[b"x"] = 1 << 63 | 10
+        table[b"y"] = 11
+        table[b"z"] = 12
+        # Two of the three insertions reused the freed slots; the third appended one.
+        self.assertEqual(list(table.items()), [(b"\x00", 0), (b"y", 11), (b"x", 1 << 63 | 10), (b"\x03", 3), (b"z", 12)])
+        self.assertEqual(len(table), 5)
+
+    def test_items_skips_freed_slots(self):
+        table = OffsetTable()
+        for i in range(5):
+            table[bytes([i])] = i
+        for i in (0, 2, 4):
+            del table[bytes([i])]
+        self.assertEqual(list(table.items()), [(b"\x01", 1), (b"\x03", 3)])
+        self.assertEqual(dict(table), {b"\x01": 1, b"\x03": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import threading
+import time
+import unittest
+
+from rw_lock import RWLock
+
+
+class RWLockTest(unittest.TestCase):
+
+    def __start(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return thread
+
+    def test_readers_share_the_lock(self):
+        lock = RWLock()
+        both_reading = threading.Barrier(3, timeout=5)
+
+        def read():
+            lock.acquire_read()
+            try:
+                both_reading.wait()
+            finally:
+                lock.release_read()
+
+        threads = [self.__start(read), self.__start(read)]
+        both_reading.wait()
+        for thread in threads:
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive())
+
+    def test_writer_excludes_readers_and_writers(self):
+        lock = RWLock()
+        events = []
+
+        def write():
+            lock.acquire_write()
+            events.append("write")
+            lock.release_write()
+
+        def read():
+            lock.acquire_read()
+            events.append("read")
+            lock.release_read()
+
+        lock.acquire_read()
+        writer = self.__start(write)
+        time.sleep(0.1)
+        self.assertEqual(events, [])
+        lock.release_read()
+        writer.join(timeout=5)
+        self.assertEqual(events, ["write"])
+
+        lock.acquire_write()
+        threads = [self.__start(read), self.__start(write)]
+        time.sleep(0.1)
+        self.assertEqual(events, ["write"])
+        lock.release_write()
+        for thread in threads:
+            thread.join(timeout=5)
+        self.assertEqual(sorted(events), ["read", "write", "write"])
+
+    def test_waiting_writer_blocks_new_readers(self):
+        lock = RWLock()
+        events = []
+
+        def write():
+            lock.acquire_write()
+            events.append("write")
+            lock.release_write()
+
+        def read():
+            lock.acquire_read()
+            events.append("read")
+            lock.release_read()
+
+        lock.acquire_read()
+        writer = self.__start(write)
+        time.sleep(0.1)
+        reader = self.__start(read)
+        time.sleep(0.1)
+        # The lock is only held for reading, yet the new reader waits behind the writer.
+        self.assertEqual(events, [])
+        lock.release_read()
+        writer.join(timeout=5)
+        reader.join(timeout=5)
+        self.assertEqual(events, ["write", "read"])
+
+
+if __name__ == "__main__":
+    unittest.main()
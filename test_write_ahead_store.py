@@ -0,0 +1,318 @@
+import errno
+import gc
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import unittest
+import warnings
+from unittest import mock
+
+import write_ahead_store
+from offset_table import OffsetTable
+from write_ahead_store import WriteAheadStore
+
+
+class WriteAheadStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__cwd = os.getcwd()
+        self.__dir = tempfile.TemporaryDirectory()
+        os.chdir(self.__dir.name)
+
+    def tearDown(self):
+        os.chdir(self.__cwd)
+        self.__dir.cleanup()
+
+    def test_dropped_store_stops_flusher(self):
+        threads = threading.active_count()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", ResourceWarning)
+            for i in range(10):
+                kv = WriteAheadStore()
+                self.assertTrue(kv.set(f"key{i}", "value"))
+                del kv
+            gc.collect()
+        self.assertEqual([w for w in caught if issubclass(w.category, ResourceWarning)], [])
+        for thread in threading.enumerate():
+            if thread.name == "wal-flusher":
+                thread.join(timeout=5)
+        self.assertEqual(threading.active_count(), threads)
+        with WriteAheadStore() as kv:
+            self.assertEqual(kv.get("key9"), b"value")
+
+    def test_failed_batch_does_not_corrupt_later_writes(self):
+        real_write = os.write
+        failures = [OSError(errno.ENOSPC, "No space left on device")]
+
+        def write(fd, data):
+            if failures:
+                raise failures.pop()
+            return real_write(fd, data)
+
+        with WriteAheadStore() as kv:
+            self.assertTrue(kv.set("a", "1"))
+            with mock.patch("os.write", write):
+                self.assertFalse(kv.set("b", "2"))
+            # The failed batch's buffer backs the batch after next, and must not hold the 2 MiB record back.
+            self.assertTrue(kv.set("c", "3"))
+            self.assertTrue(kv.set("big", "x" * (2 << 20)))
+            gc.collect()
+            self.assertTrue(kv.set("d", "4"))
+            self.assertTrue(kv.set("e", "5"))
+        with WriteAheadStore() as kv:
+            self.assertEqual(kv.get("a"), b"1")
+            self.assertIsNone(kv.get("b"))
+            self.assertEqual(kv.get("c"), b"3")
+            self.assertEqual(kv.get("big"), b"x" * (2 << 20))
+            self.assertEqual(kv.get("d"), b"4")
+            self.assertEqual(kv.get("e"), b"5")
+
+    def test_legacy_log_is_migrated(self):
+        with open("write_ahead.log", "wb") as log:
+            for key, value in ((b"a", b"1"), (b"b", b"2"), (b"a", b"11"), (b"b", b"")):
+                log.write(struct.pack("III", 1700000000, len(key), len(value)) + key + value)
+        with WriteAheadStore() as kv:
+            self.assertEqual(kv.get("a"), b"11")
+            self.assertIsNone(kv.get("b"))
+            self.assertTrue(kv.set("c", "3"))
+        with WriteAheadStore() as kv:
+            self.assertEqual(kv.get("a"), b"11")
+            self.assertEqual(kv.get("c"), b"3")
+
+    def test_legacy_log_with_torn_first_record_is_migrated(self):
+        with open("write_ahead.log", "wb") as log:
+            log.write(struct.pack("III", 1700000000, 1, 100) + b"a" + b"x" * 10)
+        with WriteAheadStore() as kv:
+            self.assertEqual(len(kv.store), 0)
+            self.assertTrue(kv.set("b", "2"))
+        with WriteAheadStore() as kv:
+            self.assertIsNone(kv.get("a"))
+            self.assertEqual(kv.get("b"), b"2")
+
+    def test_unknown_file_is_not_migrated(self):
+        with open("other.log", "wb") as other:
+            other.write(b"not a write-ahead log")
+        with WriteAheadStore() as kv:
+            with self.assertRaises(ValueError):
+                kv.set_recovery_file_path("other.log")
+        with open("other.log", "rb") as other:
+            self.assertEqual(other.read(), b"not a write-ahead log")
+
+    def test_failed_compaction_backs_off(self):
+        attempts = []
+
+        def replace(src, dst):
+            attempts.append(src)
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+        with WriteAheadStore() as kv, mock.patch.object(write_ahead_store, "COMPACTION_MIN_SIZE", 0):
+            with mock.patch("os.replace", replace):
+                for i in range(12):
+                    self.assertTrue(kv.set("key", str(i)))
+            self.assertEqual(len(attempts), 2)
+            self.assertEqual(kv.get("key"), b"11")
+
+    def test_compact(self):
+        with WriteAheadStore() as kv:
+            for round in range(5):
+                for i in range(50):
+                    self.assertTrue(kv.set(f"key{i}", f"{round}-{i}" + "x" * 200))
+            for i in range(0, 50, 5):
+                self.assertTrue(kv.delete(f"key{i}"))
+            before = os.path.getsize("write_ahead.log")
+            kv.compact()
+            self.assertLess(os.path.getsize("write_ahead.log"), before)
+            self.assertFalse(os.path.exists("write_ahead.log.compact"))
+            for i in range(50):
+                self.assertEqual(kv.get(f"key{i}"), None if i % 5 == 0 else f"4-{i}".encode() + b"x" * 200)
+            self.assertTrue(kv.set("after", "y" * 200))
+            self.assertTrue(kv.set("key1", "z" * 200))
+            self.assertEqual(kv.get("after"), b"y" * 200)
+            self.assertEqual(kv.get("key1"), b"z" * 200)
+        with WriteAheadStore() as kv:
+            self.assertEqual(len(kv.store), 41)
+            self.assertEqual(kv.get("after"), b"y" * 200)
+            self.assertEqual(kv.get("key1"), b"z" * 200)
+            self.assertEqual(kv.get("key2"), b"4-2" + b"x" * 200)
+            self.assertIsNone(kv.get("key5"))
+
+    def test_compact_after_switching_log(self):
+        with WriteAheadStore() as kv:
+            kv.set_recovery_file_path("b.log")
+            for i in range(50):
+                self.assertTrue(kv.set(f"b{i}", "x" * 200))
+        with WriteAheadStore() as kv:
+            for i in range(5):
+                self.assertTrue(kv.set(f"a{i}", "y" * 200))
+            kv.set_recovery_file_path("b.log")
+            self.assertIsNone(kv.get("a0"))
+            kv.compact()
+            kv.recovery()
+            self.assertEqual(len(kv.store), 50)
+            for i in range(50):
+                self.assertEqual(kv.get(f"b{i}"), b"x" * 200)
+
+    def test_compact_keeps_log_with_corrupted_record(self):
+        with WriteAheadStore() as kv:
+            for i in range(10):
+                self.assertTrue(kv.set(f"key{i}", "x" * 200))
+            self.assertTrue(kv.set("key0", "y" * 200))
+            with open("write_ahead.log", "r+b") as log:
+                log.seek(os.path.getsize("write_ahead.log") // 2)
+                byte = log.read(1)
+                log.seek(-1, os.SEEK_CUR)
+                log.write(bytes([byte[0] ^ 1]))
+            with open("write_ahead.log", "rb") as log:
+                data = log.read()
+            kv.compact()
+            with open("write_ahead.log", "rb") as log:
+                self.assertEqual(log.read(), data)
+            self.assertFalse(os.path.exists("write_ahead.log.compact"))
+
+    def test_recovery_of_records_spanning_chunks(self):
+        with WriteAheadStore() as kv:
+            self.assertTrue(kv.set("big", "x" * 5000))
+            self.assertTrue(kv.set("small", "s"))
+            self.assertTrue(kv.delete("big"))
+            self.assertTrue(kv.set("big", "y" * 3000))
+        with mock.patch.object(write_ahead_store, "RECOVERY_CHUNK_SIZE", 7), WriteAheadStore() as kv:
+            self.assertEqual(kv.get("big"), b"y" * 3000)
+            self.assertEqual(kv.get("small"), b"s")
+            self.assertEqual(len(kv.store), 2)
+
+    def __write_records(self):
+        with WriteAheadStore() as kv:
+            for i in range(10):
+                self.assertTrue(kv.set(f"k{i}", "x" * 200))
+        # _LOG_MAGIC, then 10 records of a 16-byte header, a 2-byte key and a 200-byte value.
+        self.assertEqual(os.path.getsize("write_ahead.log"), 8 + 10 * 218)
+
+    def test_recovery_truncates_at_corrupted_record(self):
+        self.__write_records()
+        with open("write_ahead.log", "r+b") as log:
+            log.seek(8 + 5 * 218 + 100)
+            log.write(b"y")
+        with WriteAheadStore() as kv:
+            self.assertEqual(os.path.getsize("write_ahead.log"), 8 + 5 * 218)
+            for i in range(10):
+                self.assertEqual(kv.get(f"k{i}"), b"x" * 200 if i < 5 else None)
+            self.assertTrue(kv.set("k5", "z"))
+        with WriteAheadStore() as kv:
+            self.assertEqual(kv.get("k4"), b"x" * 200)
+            self.assertEqual(kv.get("k5"), b"z")
+            self.assertIsNone(kv.get("k6"))
+
+    def test_recovery_truncates_incomplete_record(self):
+        self.__write_records()
+        os.truncate("write_ahead.log", 8 + 10 * 218 - 10)
+        with WriteAheadStore() as kv:
+            self.assertEqual(os.path.getsize("write_ahead.log"), 8 + 9 * 218)
+            self.assertEqual(kv.get("k8"), b"x" * 200)
+            self.assertIsNone(kv.get("k9"))
+            self.assertTrue(kv.set("k9", "z"))
+        with WriteAheadStore() as kv:
+            self.assertEqual(kv.get("k9"), b"z")
+
+    def test_offset_table_through_recovery_and_compaction(self):
+        with WriteAheadStore(offset_table=True) as kv:
+            for i in range(100):
+                self.assertTrue(kv.set(f"key{i}", f"{i}" + "x" * 200))
+            for i in range(0, 100, 2):
+                self.assertTrue(kv.delete(f"key{i}"))
+        with WriteAheadStore(offset_table=True) as kv:
+            self.assertIsInstance(kv.store, OffsetTable)
+            self.assertEqual(len(kv.store), 50)
+            before = os.path.getsize("write_ahead.log")
+            kv.compact()
+            self.assertLess(os.path.getsize("write_ahead.log"), before)
+            self.assertIsInstance(kv.store, OffsetTable)
+            self.assertTrue(kv.set("key0", "new" + "y" * 200))
+        with WriteAheadStore(offset_table=True) as kv:
+            self.assertEqual(len(kv.store), 51)
+            self.assertEqual(kv.get("key0"), b"new" + b"y" * 200)
+            self.assertIsNone(kv.get("key2"))
+            self.assertEqual(kv.get("key99"), b"99" + b"x" * 200)
+
+    def test_unmapped_tail_is_read_with_pread(self):
+        with WriteAheadStore() as kv:
+            for i in range(100):
+                self.assertTrue(kv.set(f"key{i}", "x" * 300))
+            self.assertEqual(kv.get("key0"), b"x" * 300)
+            self.assertTrue(kv.set("small", "y" * 300))
+            self.assertTrue(kv.set("large", "z" * 10000))
+            with mock.patch("os.pread", wraps=os.pread) as pread, \
+                    mock.patch.object(write_ahead_store.mmap, "mmap", wraps=mmap.mmap) as remap:
+                self.assertEqual(kv.get("key99"), b"x" * 300)
+                self.assertEqual(pread.call_count, 0)
+                self.assertEqual(kv.get("small"), b"y" * 300)
+                self.assertEqual(pread.call_count, 1)
+                # A value larger than READ_AHEAD_SIZE takes a second positional read.
+                self.assertEqual(kv.get("large"), b"z" * 10000)
+                self.assertEqual(pread.call_count, 3)
+                self.assertEqual(remap.call_count, 0)
+
+    def test_log_is_mapped_again_past_remap_size(self):
+        with WriteAheadStore() as kv, mock.patch.object(write_ahead_store, "MMAP_REMAP_SIZE", 4096):
+            for i in range(100):
+                self.assertTrue(kv.set(f"key{i}", "x" * 300))
+            self.assertEqual(kv.get("key0"), b"x" * 300)
+            for i in range(20):
+                self.assertTrue(kv.set(f"more{i}", "y" * 300))
+            with mock.patch("os.pread", wraps=os.pread) as pread, \
+                    mock.patch.object(write_ahead_store.mmap, "mmap", wraps=mmap.mmap) as remap:
+                self.assertEqual(kv.get("more19"), b"y" * 300)
+                self.assertEqual(kv.get("more0"), b"y" * 300)
+                self.assertEqual(remap.call_count, 1)
+                self.assertEqual(pread.call_count, 0)
+
+    def test_inline_values(self):
+        small, large = "s" * write_ahead_store.INLINE_THRESHOLD, "l" * (write_ahead_store.INLINE_THRESHOLD + 1)
+        with WriteAheadStore() as kv:
+            self.assertTrue(kv.set("a", small))
+            self.assertTrue(kv.set("b", small))
+            self.assertTrue(kv.set("c", large))
+            with mock.patch.object(WriteAheadStore, "_WriteAheadStore__read_record", side_effect=AssertionError) as read:
+                self.assertEqual(kv.get("a"), small.encode())
+                self.assertTrue(kv.delete("a"))
+                self.assertIsNone(kv.get("a"))
+                self.assertEqual(read.call_count, 0)
+            # A larger value replaces the inline one, and a small one is kept inline again.
+            self.assertTrue(kv.set("b", large))
+            self.assertEqual(kv.get("b"), large.encode())
+            self.assertTrue(kv.set("c", small))
+            self.assertEqual(kv.get("c"), small.encode())
+        with WriteAheadStore() as kv:
+            with mock.patch.object(WriteAheadStore, "_WriteAheadStore__read_record", side_effect=AssertionError):
+                self.assertIsNone(kv.get("a"))
+                self.assertEqual(kv.get("c"), small.encode())
+            self.assertEqual(kv.get("b"), large.encode())
+
+    def test_partly_written_batch_is_rolled_back(self):
+        real_write = os.write
+        calls = []
+
+        def write(fd, data):
+            calls.append(len(data))
+            if len(calls) == 1:
+                return real_write(fd, bytes(data[:7]))
+            raise OSError(errno.EIO, "Input/output error")
+
+        with WriteAheadStore() as kv:
+            self.assertTrue(kv.set("a", "1"))
+            size = os.path.getsize("write_ahead.log")
+            with mock.patch("os.write", write):
+                self.assertFalse(kv.set("b", "2"))
+            self.assertEqual(len(calls), 2)
+            self.assertEqual(os.path.getsize("write_ahead.log"), size)
+            self.assertTrue(kv.set("c", "3"))
+        with WriteAheadStore() as kv:
+            self.assertEqual(kv.get("a"), b"1")
+            self.assertIsNone(kv.get("b"))
+            self.assertEqual(kv.get("c"), b"3")
+            self.assertEqual(len(kv.store), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
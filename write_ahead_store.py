@@ -1,8 +1,21 @@
+import functools
+import itertools
+import mmap
+import os
 import struct
 import time
-import portalocker
+import weakref
+import zlib
 import threading
+try:
+    import fcntl
+except ImportError:
+    # No fcntl on Windows: fall back to portalocker for file locking.
+    fcntl = None
+    import portalocker
 from logger import Logger
+from offset_table import OffsetTable
+from rw_lock import RWLock
 from base_store import BaseStore
 
 from enum import Enum
@@ -11,31 +24,166 @@ class LOCK_STATE(Enum):
     EXCLUSIVE = "exclusive"
     SHARED = "shared"
 
+# Record header: sequence number, key length, value length and CRC-32, as little-endian unsigned 32-bit ints.
+_HEADER = struct.Struct("<IIII")
+# The CRC-32 is the last header field; it covers the header bytes before it, the key and the value.
+_CRC = struct.Struct("<I")
+_CRC_OFFSET = _HEADER.size - _CRC.size
+# Marker at the start of every write-ahead log, identifying the record format.
+_LOG_MAGIC = b"WALCRC01"
+# Record header of logs written before _LOG_MAGIC: timestamp, key length and value length, as native unsigned ints.
+_LEGACY_HEADER = struct.Struct("III")
+# Flushes a file's data to disk; fdatasync skips the metadata update where the platform has it.
+_fdatasync = getattr(os, "fdatasync", os.fsync)
+# High bit of an in-memory store entry, marking a set key; the remaining bits hold the record offset.
+SET_BIT = 1 << 63
+# os.pread and os.posix_fadvise are not available on every platform (e.g. Windows).
+_HAS_PREAD = hasattr(os, "pread")
+_HAS_FADVISE = hasattr(os, "posix_fadvise")
+# Largest unmapped tail of the log served with os.pread before the log is mapped again.
+MMAP_REMAP_SIZE = 16 << 20
+# Number of value bytes read along with the header and key by a positional read.
+READ_AHEAD_SIZE = 4096
+# Largest value, in bytes, kept in memory next to the store so get can skip the log entirely.
+INLINE_THRESHOLD = 128
+# The log is compacted once it holds more than COMPACTION_RATIO records per live key...
+COMPACTION_RATIO = 4
+# ...and has grown past COMPACTION_MIN_SIZE bytes.
+COMPACTION_MIN_SIZE = 64 << 20
+# Number of recently used keys whose UTF-8 encoding is cached.
+KEY_CACHE_SIZE = 4096
+# Size of the preallocated buffers records are copied into before being written.
+BATCH_BUFFER_SIZE = 1 << 20
+# Size of the chunks the write-ahead log is read in during recovery.
+RECOVERY_CHUNK_SIZE = 1 << 20
+
+def _record_crc(view, position, key_start, record_end):
+    """
+    Computes the CRC-32 of the record at `position` in `view`.
+
+    Args:
+        view (memoryview): A view of the bytes holding the record.
+        position (int): The position of the record header.
+        key_start (int): The position of the key, right after the header.
+        record_end (int): The position just past the value.
+
+    Returns:
+        int: The CRC-32 of the header fields before the checksum, the key and the value.
+    """
+    return zlib.crc32(view[key_start:record_end], zlib.crc32(view[position:position + _CRC_OFFSET]))
+
+class _WriteBatch:
+    """
+    A group of write-ahead log records handed to the background flusher in one go.
+
+    - `buffer` is a preallocated buffer holding the encoded records back to back, in submission order.
+    - `length` is the number of bytes of `buffer` in use.
+    - `updates` holds a (key bytes, position in buffer, SET_BIT or 0, inline value or None) entry per
+      record; they are applied to the in-memory store only once the buffer has reached the log file.
+    - `done` and `error` report the outcome of the write to the waiting callers.
+    """
+    __slots__ = ("buffer", "length", "updates", "done", "error")
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.length = 0
+        self.updates = []
+        self.done = False
+        self.error = None
+
+    def reserve(self, size):
+        """
+        Reserves `size` bytes at the end of the batch, growing the buffer if it is too small.
+
+        The buffer is grown before the length is updated, so a failed resize leaves the batch unchanged.
+
+        Args:
+            size (int): The number of bytes to reserve.
+
+        Returns:
+            int: The position of the reserved bytes in the buffer.
+        """
+        position = self.length
+        end = position + size
+        if end > len(self.buffer):
+            self.buffer += bytes(max(end, 2 * len(self.buffer)) - len(self.buffer))
+        self.length = end
+        return position
+
 class WriteAheadStore(BaseStore):
 
-    def __init__(self):
+    def __init__(self, interprocess: bool = False, sync: bool = False, offset_table: bool = False):
         """
         Initializes the key-value store instance.
 
-        - Sets up an internal dictionary to store key-value pairs.
+        Args:
+            interprocess (bool): Set to True when several processes share the write-ahead log.
+                File locks are only taken in this mode; a single process relies on its thread lock.
+            sync (bool): Set to True to fsync the write-ahead log after every batch, so a set or delete
+                only returns once its record has reached the disk. The cost of the fsync is shared by
+                every record in the batch.
+            offset_table (bool): Set to True to keep the in-memory store in an OffsetTable, with the record
+                offsets in one contiguous array, instead of a dict; full scans such as compaction then read
+                the offsets sequentially.
+
+        - Sets up an internal dictionary (or OffsetTable) to store key-value pairs.
+        - Sets up a second dictionary holding the values of set keys no larger than INLINE_THRESHOLD bytes.
+        - Counts the records in the log and the live (set) keys, to decide when to compact the log, and
+          tracks the record count automatic compaction has to wait for after a failed compaction.
         - Initializes a Logger instance for logging operations.
         - Sets the file path for the write-ahead log.
         - Default log file_path is "write_ahead.log".
-        - Opens the write-ahead log file in append-binary mode.
-        - Creates a thread lock to ensure thread-safe operations.
+        - Opens the write-ahead log file, migrating a log in the legacy format, and tracks the next write offset.
+        - Leaves the read-only mapping of the log unset; it is created by the first get.
+        - Creates an LRU cache of key encodings, so hot keys are not UTF-8 encoded on every call.
+        - Starts the record sequence counter at the current time; recovery moves it past the last logged record.
+        - Creates a readers-writer lock: gets share it, while operations replacing the log file,
+          its mapping or the in-memory store take it exclusively.
+        - Creates a reentrant thread lock, guarding the pending write batch, and the conditions built on it.
+        - Preallocates the pair of batch buffers the writers and the background flusher take turns on.
         - Calls the recovery method to restore state from the write-ahead log.
+        - Starts the background flusher thread that writes pending batches to the log. The thread only holds
+          a weak reference to the store, and a finalizer wakes it up to exit and closes the log file once
+          the store is garbage collected, so a store dropped without close() does not leak either.
         """
-        self.__store = {}
+        self.__finalizer = None
+        self.__offset_table = offset_table
+        self.__store = self.__new_store()
+        self.__inline_values = {}
+        self.__record_count = 0
+        self.__live_count = 0
+        self.__compaction_retry_count = 0
         self.__logger = Logger()
+        self.__interprocess = interprocess
+        self.__sync = sync
         self.__write_ahead_log_file_path = "write_ahead.log"
-        self.__file = open(self.__write_ahead_log_file_path, "ab+")
-        self.__thread_lock = threading.Lock() 
+        self.__open_log()
+        self.__mmap = None
+        self.__encode_key = functools.lru_cache(maxsize=KEY_CACHE_SIZE)(str.encode)
+        self.__next_sequence = itertools.count(int(time.time())).__next__
+        self.__rw_lock = RWLock()
+        self.__thread_lock = threading.RLock()
+        self.__work_cv = threading.Condition(self.__thread_lock)
+        self.__done_cv = threading.Condition(self.__thread_lock)
+        self.__free_buffers = [bytearray(BATCH_BUFFER_SIZE)]
+        self.__batch = _WriteBatch(bytearray(BATCH_BUFFER_SIZE))
+        self.__writer_busy = False
+        self.__closed = False
         self.recovery()
+        self.__flusher = threading.Thread(target=WriteAheadStore.__flush_loop, args=(weakref.ref(self), self.__work_cv),
+                                          name="wal-flusher", daemon=True)
+        self.__flusher.start()
+        self.__register_finalizer()
 
     @property
     def store(self):
+        """Returns the in-memory store, mapping each UTF-8 encoded key to its record offset with SET_BIT marking a set key"""
         return self.__store
 
+    def __new_store(self):
+        """Returns an empty in-memory store: an OffsetTable if the store was created with offset_table=True, else a dict."""
+        return OffsetTable() if self.__offset_table else {}
+
     def __lock_file(self, file, mode: LOCK_STATE):
         """
         Acquire a lock on the underlying file object.
@@ -46,15 +194,21 @@ class WriteAheadStore(BaseStore):
                 - LOCK_STATE.EXCLUSIVE: Acquire an exclusive lock for writing.
                 - LOCK_STATE.SHARED: Acquire a shared lock for reading.
 
-        Uses the `portalocker` library to lock the file. An exclusive lock prevents other processes from accessing the file,
-        while a shared lock allows concurrent read access.
+        Calls `fcntl.flock` directly where fcntl exists, and uses the `portalocker` library otherwise (Windows).
+        An exclusive lock prevents other processes from accessing the file, while a shared lock allows concurrent read access.
+        Does nothing unless the store was created with interprocess=True.
 
         Raises:
-            portalocker.exceptions.LockException: If the lock cannot be acquired.
+            OSError: If flock fails.
+            portalocker.exceptions.LockException: If the lock cannot be acquired through portalocker.
         """
         if not file:
             raise ValueError("File object is required for locking")
-        if mode == LOCK_STATE.EXCLUSIVE:
+        if not self.__interprocess:
+            return
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX if mode == LOCK_STATE.EXCLUSIVE else fcntl.LOCK_SH)
+        elif mode == LOCK_STATE.EXCLUSIVE:
             portalocker.lock(file, portalocker.LOCK_EX)
         elif mode == LOCK_STATE.SHARED:
             portalocker.lock(file, portalocker.LOCK_SH)
@@ -63,12 +217,18 @@ class WriteAheadStore(BaseStore):
         """
         Release the lock on the underlying file object.
 
-        Uses the `portalocker` library to unlock the file after a lock has been acquired.
+        Calls `fcntl.flock` directly where fcntl exists, and uses the `portalocker` library otherwise (Windows).
         Should be called in a finally block to ensure the file is always unlocked.
+        Does nothing unless the store was created with interprocess=True.
         """
         if not file:
             raise ValueError("File object is required for unlocking")
-        portalocker.unlock(file)
+        if not self.__interprocess:
+            return
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        else:
+            portalocker.unlock(file)
 
     def set_log_file_path(self, file_path):
         """
@@ -88,84 +248,689 @@ class WriteAheadStore(BaseStore):
         """
         Sets the file path for the write-ahead log used during recovery.
 
+        - Waits for in-flight gets and pauses the background flusher.
+        - Opens the new log, keeping the current one if that fails.
+        - Rebuilds the in-memory store, the inline values and the record and live key counts from the new log,
+          so they never point at offsets in the previous one.
+
         Args:
             file_path (str): The path to the write-ahead log file.
 
         Raises:
-            ValueError: If the file path is empty.
+            ValueError: If the file path is empty, or the file is not a write-ahead log. A log in the legacy
+                format is migrated to the current one.
+            Exception: Any error raised while recovering from the new log.
         """
         if not file_path:
             raise ValueError("File path cannot be empty")
-        self.__write_ahead_log_file_path = file_path
-        self.__file.close()
-        self.__file = open(self.__write_ahead_log_file_path, "ab+")
+        self.__rw_lock.acquire_write()
+        self.__pause_flusher()
+        try:
+            previous_path, previous_file = self.__write_ahead_log_file_path, self.__file
+            self.__write_ahead_log_file_path = file_path
+            try:
+                self.__open_log()
+            except Exception:
+                self.__write_ahead_log_file_path = previous_path
+                raise
+            previous_file.close()
+            self.__mmap = None
+            self.__compaction_retry_count = 0
+            self.__recovery()
+        finally:
+            self.__resume_flusher()
+            self.__rw_lock.release_write()
+
+    def __open_log(self):
+        """
+        Opens the write-ahead log file in unbuffered append-binary mode and tracks the next write offset.
+
+        - Writes the _LOG_MAGIC marker to a new, empty log.
+        - Checks an existing log starts with the marker, so a log in an older record format is never
+          parsed, or truncated, as the current one.
+        - Migrates a log written before the marker existed to the current format, then opens the migrated log.
+
+        Raises:
+            ValueError: If the file is neither a write-ahead log in the current format nor a legacy one.
+        """
+        migrated = False
+        file = open(self.__write_ahead_log_file_path, "ab+", buffering=0)
+        try:
+            self.__lock_file(file, LOCK_STATE.EXCLUSIVE)
+            try:
+                size = os.fstat(file.fileno()).st_size
+                if size == 0:
+                    file.write(_LOG_MAGIC)
+                    size = len(_LOG_MAGIC)
+                else:
+                    file.seek(0)
+                    if file.read(len(_LOG_MAGIC)) != _LOG_MAGIC:
+                        self.__migrate_legacy_log(file, size)
+                        migrated = True
+            finally:
+                self.__unlock_file(file)
+        except Exception:
+            file.close()
+            raise
+        if migrated:
+            file.close()
+            self.__open_log()
+            return
+        self.__file = file
+        self.__next_offset = size
+        if self.__finalizer is not None:
+            self.__register_finalizer()
+
+    def __migrate_legacy_log(self, file, size):
+        """
+        Rewrites a write-ahead log in the legacy format (no _LOG_MAGIC marker, 12-byte timestamp, key length
+        and value length headers, no CRC) in the current format, in place.
+
+        - Maps the legacy log and finds the last record of every key; deleted keys are dropped.
+        - Rejects the file unless the header and key of its first record are complete and every key is
+          non-empty UTF-8, so a file that is not a write-ahead log is never rewritten.
+        - Drops an incomplete record at the end of the log (a write cut short by a crash) and logs a warning;
+          a log holding only a torn first record is migrated to an empty log.
+        - Writes the live records after the _LOG_MAGIC marker to a new file next to the log, with the legacy
+          timestamp as sequence number and a CRC-32, syncs it and atomically replaces the log with it.
+        - Removes the partially written file if anything fails before the replace.
+
+        Args:
+            file: The open legacy log file, locked exclusively.
+            size (int): The size of the legacy log.
+
+        Raises:
+            ValueError: If the file is not a legacy write-ahead log either.
+        """
+        path = self.__write_ahead_log_file_path
+        not_a_log = f"'{path}' is not a write-ahead log"
+        live = {}
+        offset = 0
+        with mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as view:
+            while offset + _LEGACY_HEADER.size <= size:
+                _, key_length, value_length = _LEGACY_HEADER.unpack_from(view, offset)
+                key_start = offset + _LEGACY_HEADER.size
+                key_end = key_start + key_length
+                if key_end > size:
+                    break
+                key = view[key_start:key_end]
+                try:
+                    key.decode()
+                except UnicodeDecodeError:
+                    raise ValueError(not_a_log) from None
+                if not key_length:
+                    raise ValueError(not_a_log)
+                if key_end + value_length > size:
+                    break
+                if value_length > 0:
+                    live[key] = offset
+                else:
+                    live.pop(key, None)
+                offset = key_end + value_length
+            if offset == 0 and (size < _LEGACY_HEADER.size or key_end > size):
+                raise ValueError(not_a_log)
+            if offset < size:
+                self.__logger.warning("Dropped incomplete record at offset %s of legacy write-ahead log '%s'", offset, path)
+            migrate_path = path + ".migrate"
+            try:
+                with open(migrate_path, "wb", buffering=BATCH_BUFFER_SIZE) as out:
+                    out.write(_LOG_MAGIC)
+                    for start in live.values():
+                        timestamp, key_length, value_length = _LEGACY_HEADER.unpack_from(view, start)
+                        key_start = start + _LEGACY_HEADER.size
+                        record = bytearray(_HEADER.size + key_length + value_length)
+                        _HEADER.pack_into(record, 0, timestamp, key_length, value_length, 0)
+                        record[_HEADER.size:] = view[key_start:key_start + key_length + value_length]
+                        with memoryview(record) as record_view:
+                            crc = _record_crc(record_view, 0, _HEADER.size, len(record))
+                        _CRC.pack_into(record, _CRC_OFFSET, crc)
+                        out.write(record)
+                    out.flush()
+                    _fdatasync(out.fileno())
+                os.replace(migrate_path, path)
+            except Exception:
+                if os.path.exists(migrate_path):
+                    os.remove(migrate_path)
+                raise
+        self.__logger.warning("Migrated legacy write-ahead log '%s' to the current format, %s live records", path, len(live))
+
+    def close(self):
+        """
+        Closes the key-value store.
+
+        - Stops accepting new writes.
+        - Lets the background flusher write every pending batch, then waits for it to exit.
+        - Waits for in-flight gets, then drops the read-only mapping and closes the write-ahead log file.
+        """
+        with self.__thread_lock:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__work_cv.notify()
+        self.__flusher.join()
+        self.__rw_lock.acquire_write()
+        try:
+            self.__mmap = None
+            self.__file.close()
+        finally:
+            self.__rw_lock.release_write()
+
+    def __pause_flusher(self):
+        """
+        Waits for the background flusher to finish its current batch and keeps it from starting another one.
+
+        Must be paired with __resume_flusher, so the caller can safely swap or read the log file.
+        """
+        with self.__thread_lock:
+            self.__done_cv.wait_for(lambda: not self.__writer_busy)
+            self.__writer_busy = True
+
+    def __resume_flusher(self):
+        """
+        Lets the background flusher continue with pending batches after __pause_flusher.
+        """
+        with self.__thread_lock:
+            self.__writer_busy = False
+            self.__work_cv.notify()
+            self.__done_cv.notify_all()
+
+    def __register_finalizer(self):
+        """
+        Registers the finalizer releasing the flusher thread and the current log file once the store is
+        garbage collected, replacing the one registered for a previous log file. The finalizer does not
+        run at interpreter exit, when the daemon flusher thread and the file go away with the process.
+        """
+        if self.__finalizer is not None:
+            self.__finalizer.detach()
+        self.__finalizer = weakref.finalize(self, WriteAheadStore.__release, self.__work_cv, self.__flusher, self.__file)
+        # At interpreter exit the store may still be alive, so its flusher would never exit.
+        self.__finalizer.atexit = False
+
+    @staticmethod
+    def __release(work_cv, flusher, file):
+        """
+        Finalizer of a garbage collected store.
+
+        - Wakes up its background flusher so it sees the store is gone and exits, and waits for it to exit.
+        - Closes the log file.
+        - May run on the flusher thread itself, while it holds the (reentrant) thread lock; it then does
+          not wait for the flusher, which exits as soon as the finalizer returns.
+        """
+        with work_cv:
+            work_cv.notify()
+        if flusher is not threading.current_thread():
+            flusher.join()
+        file.close()
+
+    @staticmethod
+    def __flush_loop(store_ref, work_cv):
+        """
+        Body of the background flusher thread.
+
+        - Holds the store through a weak reference while idle, and a strong one only while flushing a batch,
+          so the store can be garbage collected; the thread exits once it is.
+        - Waits until records are pending and no other operation owns the log file, then flushes them.
+        - Exits once the store is closed and every pending batch has been written.
+
+        Args:
+            store_ref (weakref.ref): A weak reference to the store.
+            work_cv (threading.Condition): The store's condition signalled when records are pending.
+        """
+        def ready():
+            store = store_ref()
+            if store is not None:
+                pending = store.__has_pending_work()
+                # Dropping the last reference here runs the finalizer, so check the store again afterwards.
+                del store
+                if pending:
+                    return True
+            return store_ref() is None
+
+        while True:
+            with work_cv:
+                work_cv.wait_for(ready)
+            store = store_ref()
+            if store is None or not store.__flush_batch():
+                return
+            del store
+
+    def __has_pending_work(self):
+        """Returns whether the flusher has a batch to write, or has to exit, and no other operation owns the log file."""
+        return (self.__batch.updates or self.__closed) and not self.__writer_busy
+
+    def __flush_batch(self):
+        """
+        Writes the pending batch for the background flusher.
+
+        - Swaps the pending batch for an empty one on the spare buffer, so writers can keep queueing while it is written.
+        - Writes the whole batch with a single write call and wakes up the waiting callers.
+        - Hands the buffer back for reuse, unless it had to grow past BATCH_BUFFER_SIZE or the write failed.
+        - Compacts the log once it holds more than COMPACTION_RATIO records per live key and has grown
+          past COMPACTION_MIN_SIZE bytes (never in interprocess mode). After a failed compaction, waits
+          until the log holds twice the records it held then, instead of retrying after every batch.
+
+        Returns:
+            bool: False once the store is closed and every pending batch has been written, True otherwise.
+        """
+        with self.__thread_lock:
+            if not self.__has_pending_work():
+                return True
+            if not self.__batch.updates:
+                return False
+            batch = self.__batch
+            buffer = self.__free_buffers.pop() if self.__free_buffers else bytearray(BATCH_BUFFER_SIZE)
+            self.__batch = _WriteBatch(buffer)
+            self.__writer_busy = True
+        self.__write_batch(batch)
+        with self.__thread_lock:
+            if batch.error is None and len(batch.buffer) == BATCH_BUFFER_SIZE:
+                self.__free_buffers.append(batch.buffer)
+            batch.done = True
+            self.__writer_busy = False
+            self.__done_cv.notify_all()
+        if (not self.__interprocess and self.__next_offset >= COMPACTION_MIN_SIZE
+                and self.__record_count > COMPACTION_RATIO * self.__live_count
+                and self.__record_count >= self.__compaction_retry_count):
+            self.compact()
+        return True
+
+    def __write_batch(self, batch):
+        """
+        Appends a batch of records to the write-ahead log and publishes them to the in-memory store.
+
+        - Acquires an exclusive file lock once for the whole batch.
+        - In interprocess mode, takes the next offset from the file size, since other processes may have appended.
+        - Writes the used part of the batch buffer, looping only on short writes. Every view of the buffer
+          is released before returning, so none outlives the write and blocks resizing the buffer.
+        - With sync enabled, syncs the log file once for the whole batch (group commit).
+        - Updates the in-memory store with the offset of every record, in submission order, and keeps
+          small values inline.
+        - Updates the record and live key counts.
+        - On failure, truncates the log back to the tracked next offset, so a partly written batch does not
+          leave a torn record in front of later batches, and records the error, without its traceback,
+          on the batch.
 
+        Args:
+            batch (_WriteBatch): The batch to write.
+        """
+        try:
+            self.__lock_file(self.__file, LOCK_STATE.EXCLUSIVE)
+            try:
+                fd = self.__file.fileno()
+                if self.__interprocess:
+                    self.__next_offset = os.fstat(fd).st_size
+                try:
+                    with memoryview(batch.buffer) as view:
+                        written = 0
+                        while written < batch.length:
+                            with view[written:batch.length] as pending:
+                                written += os.write(fd, pending)
+                    if self.__sync:
+                        _fdatasync(fd)
+                except Exception:
+                    os.ftruncate(fd, self.__next_offset)
+                    raise
+            finally:
+                self.__unlock_file(self.__file)
+        except Exception as e:
+            self.__logger.error("Error writing batch of %s records: %s", len(batch.updates), e)
+            batch.error = e.with_traceback(None)
+            return
+        offset = self.__next_offset
+        self.__next_offset += batch.length
+        self.__record_count += len(batch.updates)
+        for key, position, flag, value in batch.updates:
+            previous = self.__store.get(key)
+            if previous is not None and previous & SET_BIT:
+                self.__live_count -= 1
+            if flag:
+                self.__live_count += 1
+            self.__store[key] = (offset + position) | flag
+            if value is None:
+                self.__inline_values.pop(key, None)
+            else:
+                self.__inline_values[key] = value
+
+    def __map_log(self):
+        """
+        Maps the whole write-ahead log read-only and keeps the mapping for later reads.
+
+        Previous mappings are never closed explicitly, so a concurrent reader still holding
+        one can finish with it; it is unmapped once the last reference is dropped.
+
+        Returns:
+            mmap.mmap: The new mapping of the write-ahead log.
+        """
+        view = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__mmap = view
+        return view
+
+    def __read_record(self, offset, key_length):
+        """
+        Reads the key and value bytes of the record at `offset` in the write-ahead log.
+
+        - Slices the record out of the memory mapping when the mapping covers it.
+        - A record written after the log was mapped is read with os.pread on the open log file,
+          as long as the unmapped tail of the log is smaller than both the mapping and MMAP_REMAP_SIZE;
+          otherwise the log is mapped again, so the mapping grows in large steps instead of on every write.
+        - Falls back to mapping the log again where os.pread is not available.
+
+        Args:
+            offset (int): The offset of the record.
+            key_length (int): The expected key length, used to size the first positional read.
+
+        Returns:
+            tuple[bytes, bytes]: The key and value bytes stored in the record.
+        """
+        view = self.__mmap
+        if view is None or offset + _HEADER.size > len(view):
+            mapped = len(view) if view is not None else 0
+            if _HAS_PREAD and self.__next_offset - mapped < min(mapped, MMAP_REMAP_SIZE):
+                return self.__pread_record(offset, key_length)
+            view = self.__map_log()
+        _, key_length, value_length, _ = _HEADER.unpack_from(view, offset)
+        key_start = offset + _HEADER.size
+        value_start = key_start + key_length
+        value_end = value_start + value_length
+        if value_end > len(view):
+            if _HAS_PREAD:
+                return self.__pread_record(offset, key_length)
+            view = self.__map_log()
+        return view[key_start:value_start], view[value_start:value_end]
+
+    def __pread_record(self, offset, key_length):
+        """
+        Reads the key and value bytes of the record at `offset` with positional reads on the open log file.
+
+        - The first read covers the header, the expected key and up to READ_AHEAD_SIZE bytes of value.
+        - A second read fetches the rest of a larger value.
+
+        Args:
+            offset (int): The offset of the record.
+            key_length (int): The expected key length, used to size the first read.
+
+        Returns:
+            tuple[bytes, bytes]: The key and value bytes stored in the record.
+        """
+        fd = self.__file.fileno()
+        data = os.pread(fd, _HEADER.size + key_length + READ_AHEAD_SIZE, offset)
+        _, key_length, value_length, _ = _HEADER.unpack_from(data)
+        key_start = _HEADER.size
+        value_start = key_start + key_length
+        value_end = value_start + value_length
+        if value_end > len(data):
+            data += os.pread(fd, value_end - len(data), offset + len(data))
+        return data[key_start:value_start], data[value_start:value_end]
+
+    def __submit(self, key_bytes, value_bytes, is_set):
+        """
+        Queues a record for the background flusher and waits until it has been written.
+
+        The header, with the next sequence number, is packed in place and the key and value are
+        copied straight into the pending batch buffer, so no intermediate header or record object
+        is built; the CRC-32 is then computed over the buffer and stored in the header.
+        Sequence numbers are taken under the thread lock, so they increase in log order.
+        Only the first record of a batch wakes up the flusher; it checks for more pending
+        records on its own after every batch.
+
+        Args:
+            key_bytes (bytes): The encoded key, which is also the in-memory store key.
+            value_bytes (bytes): The encoded value, empty for a delete record.
+            is_set (bool): True for a set record, False for a delete record.
+
+        Raises:
+            ValueError: If the store has been closed.
+            Exception: Any error raised while writing the batch containing the record.
+        """
+        with self.__thread_lock:
+            if self.__closed:
+                raise ValueError("Store is closed")
+            batch = self.__batch
+            position = batch.reserve(_HEADER.size + len(key_bytes) + len(value_bytes))
+            buffer = batch.buffer
+            key_position = position + _HEADER.size
+            value_position = key_position + len(key_bytes)
+            value_end = value_position + len(value_bytes)
+            _HEADER.pack_into(buffer, position, self.__next_sequence() & 0xFFFFFFFF, len(key_bytes), len(value_bytes), 0)
+            buffer[key_position:value_position] = key_bytes
+            buffer[value_position:value_end] = value_bytes
+            with memoryview(buffer) as view:
+                crc = _record_crc(view, position, key_position, value_end)
+            _CRC.pack_into(buffer, position + _CRC_OFFSET, crc)
+            inline_value = value_bytes if is_set and len(value_bytes) <= INLINE_THRESHOLD else None
+            batch.updates.append((key_bytes, position, SET_BIT if is_set else 0, inline_value))
+            if len(batch.updates) == 1:
+                self.__work_cv.notify()
+            while not batch.done:
+                self.__done_cv.wait()
+        if batch.error is not None:
+            raise batch.error
 
     def recovery(self):
         """
         Attempts to recover the key-value store state from the write-ahead log.
 
-        Calls the internal __recovery method to restore the in-memory store from the log file.
+        Waits for in-flight gets, pauses the background flusher and calls the internal __recovery
+        method to restore the in-memory store from the log file.
         Logs an error if recovery fails.
         """
+        self.__rw_lock.acquire_write()
+        self.__pause_flusher()
         try:
             self.__recovery()
         except Exception as e:
-            self.__logger.error(f"Error during recovery: {e}")
+            self.__logger.error("Error during recovery: %s", e)
+        finally:
+            self.__resume_flusher()
+            self.__rw_lock.release_write()
 
     def __recovery(self):
         """
         Internal method to restore the in-memory store from the write-ahead log.
 
-        - Reads the log file sequentially.
-        - For each record, unpacks the header to get key and value lengths.
-        - Decodes the key and checks if the value exists (value_length > 0).
-        - Updates the in-memory store with the key, its offset, and set/delete status.
-        - Handles corrupted records by raising exceptions.
+        - Checks the log starts with the _LOG_MAGIC marker.
+        - Advises the kernel the log is read sequentially, for aggressive readahead, where posix_fadvise exists.
+        - Reads the log file sequentially in RECOVERY_CHUNK_SIZE chunks, appended to a growable buffer after
+          dropping the parsed records in front of it, so a record spanning many chunks is read in linear time.
+        - Parses the buffered records in memory, unpacking each header in place to get key and value lengths.
+        - Keeps a record split across two chunks in the buffer until the next chunk completes it.
+        - Verifies the CRC-32 of every record and stops at the first mismatch.
+        - Copies out the raw key bytes, without decoding them, and checks if the value exists (value_length > 0).
+        - Updates the in-memory store with the key and its offset, with SET_BIT marking a set key;
+          deleted keys are dropped.
+        - Keeps values no larger than INLINE_THRESHOLD bytes inline, so get does not read them back from the log.
+        - Restarts the sequence counter past the highest sequence number in the log, or at the current
+          time if that is later.
+        - Counts the records read and the live keys left in the store.
+        - Advises the kernel to drop the log's cached pages once read, to leave less memory pressure behind.
+        - Truncates a torn or corrupted tail (a record failing its CRC, or cut short) and logs a warning.
         - Logs completion of recovery.
 
         Raises:
-            Exception: If a corrupted key or value is detected in the log.
+            Exception: If the log does not start with the _LOG_MAGIC marker.
         """
-        offset = 0
-        self.__store = {}
-        with open(self.__write_ahead_log_file_path, "rb") as f:
+        offset = len(_LOG_MAGIC)
+        record_count = 0
+        self.__store = self.__new_store()
+        self.__inline_values = {}
+        corrupted = False
+        with open(self.__write_ahead_log_file_path, "rb", buffering=0) as f:
             try:
                 self.__lock_file(f,LOCK_STATE.SHARED)
-                while True:
-                    header = f.read(12)
-                    if not header or len(header) < 12:
+                if _HAS_FADVISE:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                magic = f.read(len(_LOG_MAGIC))
+                if magic != _LOG_MAGIC:
+                    raise Exception(f"Missing write-ahead log marker in '{self.__write_ahead_log_file_path}'")
+                header_size = _HEADER.size
+                unpack_header = _HEADER.unpack_from
+                last_sequence = 0
+                buffer = bytearray()
+                position = 0
+                while not corrupted:
+                    chunk = f.read(RECOVERY_CHUNK_SIZE)
+                    if not chunk:
                         break
-                    _, key_length, value_length = struct.unpack("III", header)
-                    key_bytes = f.read(key_length)
-                    if len(key_bytes) < key_length:
-                        raise Exception(f"Corrupted key at offset {offset}")
-                    key = key_bytes.decode()
-                    if value_length >0:
-                        value_bytes = f.read(value_length)
-                        if len(value_bytes) < value_length:
-                            raise Exception(f"Corrupted value at offset {offset}")
-                        self.__store[key] = (offset, True)
-                    else:
-                        self.__store.pop(key, None)
-                    offset += 12 + key_length + value_length
-                self.__logger.info("Recovery completed successfully")
+                    del buffer[:position]
+                    buffer += chunk
+                    position = 0
+                    with memoryview(buffer) as view:
+                        while len(buffer) - position >= header_size:
+                            sequence, key_length, value_length, crc = unpack_header(buffer, position)
+                            key_start = position + header_size
+                            record_end = key_start + key_length + value_length
+                            if record_end > len(buffer):
+                                break
+                            if _record_crc(view, position, key_start, record_end) != crc:
+                                corrupted = True
+                                break
+                            if sequence > last_sequence:
+                                last_sequence = sequence
+                            key = bytes(view[key_start:key_start + key_length])
+                            if value_length > 0:
+                                self.__store[key] = offset | SET_BIT
+                                if value_length <= INLINE_THRESHOLD:
+                                    value_start = key_start + key_length
+                                    self.__inline_values[key] = bytes(view[value_start:record_end])
+                                else:
+                                    self.__inline_values.pop(key, None)
+                            else:
+                                self.__store.pop(key, None)
+                                self.__inline_values.pop(key, None)
+                            offset += record_end - position
+                            position = record_end
+                            record_count += 1
+                self.__next_sequence = itertools.count(max(int(time.time()), last_sequence + 1)).__next__
+                log_size = os.fstat(f.fileno()).st_size
             finally:
+                self.__record_count = record_count
+                self.__live_count = len(self.__store)
+                if _HAS_FADVISE:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
                 self.__unlock_file(f)
+        if offset < log_size:
+            reason = "CRC mismatch" if corrupted else "incomplete record"
+            self.__truncate_log(offset, log_size, reason)
+        self.__logger.info("Recovery completed successfully")
+
+    def __truncate_log(self, offset, expected_size, reason):
+        """
+        Cuts a torn or corrupted tail off the write-ahead log.
+
+        - Acquires an exclusive file lock and leaves the log alone if another process has appended
+          to it since it was read.
+        - Truncates the log at `offset`, resets the next write offset and drops the read-only mapping.
+        - Logs a warning with the reason and the number of bytes dropped.
+
+        Args:
+            offset (int): The offset of the first bad record.
+            expected_size (int): The size of the log when it was read.
+            reason (str): Why the tail is dropped, for the log message.
+        """
+        self.__lock_file(self.__file, LOCK_STATE.EXCLUSIVE)
+        try:
+            fd = self.__file.fileno()
+            if os.fstat(fd).st_size != expected_size:
+                self.__logger.warning("Write-ahead log changed during recovery, not truncating at offset %s", offset)
+                return
+            os.ftruncate(fd, offset)
+            self.__next_offset = offset
+            self.__mmap = None
+        finally:
+            self.__unlock_file(self.__file)
+        self.__logger.warning("Truncated write-ahead log at offset %s (%s), dropped %s bytes", offset, reason, expected_size - offset)
+
+    def compact(self):
+        """
+        Rewrites the write-ahead log with only the live records, so recovery time follows the number
+        of live keys instead of the number of operations ever logged.
+
+        Waits for in-flight gets, pauses the background flusher and calls the internal __compact method.
+        Logs an error if compaction fails; the original log is then left untouched, and automatic
+        compaction waits until the log holds twice as many records before trying again.
+
+        Raises:
+            ValueError: If the store was created with interprocess=True, since other processes would
+                keep appending to the replaced log file.
+        """
+        if self.__interprocess:
+            self.__logger.error("Compaction is not supported in interprocess mode")
+            raise ValueError("Compaction is not supported in interprocess mode")
+        self.__rw_lock.acquire_write()
+        self.__pause_flusher()
+        try:
+            self.__compact()
+        except Exception as e:
+            self.__compaction_retry_count = 2 * self.__record_count
+            self.__logger.error("Error during compaction: %s", e)
+        finally:
+            self.__resume_flusher()
+            self.__rw_lock.release_write()
+
+    def __compact(self):
+        """
+        Internal method to rewrite the write-ahead log with only the live records.
+
+        - Maps the current log and copies the raw bytes of every live record, header and CRC included,
+          to a new file next to it, after the _LOG_MAGIC marker.
+        - Checks every copied record holds the key the in-memory store has it for and passes its CRC-32, and
+          aborts without replacing the log otherwise, so a store out of step with the log never overwrites it.
+        - Syncs the new file and atomically replaces the log with it.
+        - Reopens the log and points the in-memory store at the new offsets; deleted keys are dropped.
+        - Removes the partially written file if anything fails before the replace.
+
+        Raises:
+            Exception: If a live record does not match the in-memory store or fails its CRC-32.
+        """
+        compact_path = self.__write_ahead_log_file_path + ".compact"
+        store = self.__new_store()
+        offset = len(_LOG_MAGIC)
+        try:
+            with memoryview(self.__map_log()) as view, open(compact_path, "wb", buffering=BATCH_BUFFER_SIZE) as out:
+                out.write(_LOG_MAGIC)
+                for key, entry in self.__store.items():
+                    if not entry & SET_BIT:
+                        continue
+                    start = entry & ~SET_BIT
+                    key_start = start + _HEADER.size
+                    if key_start > len(view):
+                        raise Exception(f"Record of key {key!r} at offset {start} is past the end of the log")
+                    _, key_length, value_length, crc = _HEADER.unpack_from(view, start)
+                    end = key_start + key_length + value_length
+                    if (end > len(view) or view[key_start:key_start + key_length] != key
+                            or _record_crc(view, start, key_start, end) != crc):
+                        raise Exception(f"Record at offset {start} does not match key {key!r}")
+                    out.write(view[start:end])
+                    store[key] = offset | SET_BIT
+                    offset += end - start
+                out.flush()
+                _fdatasync(out.fileno())
+            self.__mmap = None
+            self.__file.close()
+            os.replace(compact_path, self.__write_ahead_log_file_path)
+        except Exception:
+            if os.path.exists(compact_path):
+                os.remove(compact_path)
+            if self.__file.closed:
+                self.__open_log()
+            raise
+        self.__open_log()
+        self.__store = store
+        self.__record_count = self.__live_count = len(store)
+        self.__compaction_retry_count = 0
+        self.__logger.info("Compaction completed, %s live records in %s bytes", len(store), offset)
 
     def set(self, key: str, value: str) -> bool:
         """
         Sets the value for a given key in the key-value store.
 
-        - Acquires a thread lock to ensure thread-safe operation.
-        - Acquires an exclusive file lock to prevent concurrent writes.
-        - Encodes the key and value as bytes.
-        - Packs a header with the current timestamp, key length, and value length.
-        - Writes the header, key, and value to the write-ahead log.
-        - Updates the in-memory store with the key, its offset, and set status.
+        - Encodes the key (through the key encoding cache) and value as bytes.
+        - Packs a header with the next sequence number, key length, and value length in place in the
+          pending batch buffer, and copies the key and value after it.
+        - The background flusher writes the record to the write-ahead log together with the other pending records.
+        - Once written, the in-memory store maps the key to its offset with SET_BIT set.
         - Logs the operation and returns True on success.
         - Handles exceptions by logging errors and returns False on failure.
-        - Always releases the file lock in a finally block.
 
         Args:
             key (str): The key to set.
@@ -177,35 +942,28 @@ class WriteAheadStore(BaseStore):
         if not key or not value or not isinstance(key, str) or not isinstance(value, str):
             self.__logger.error("Key and value must be non-empty strings")
             raise ValueError("Key and value must be non-empty strings")
-        with self.__thread_lock:
-            try:
-                self.__lock_file(self.__file,LOCK_STATE.EXCLUSIVE)
-                offset = self.__file.tell()
-                key_bytes = key.encode()
-                value_bytes = value.encode()
-                header = struct.pack("III", int(time.time()), len(key_bytes), len(value_bytes))
-                header += key_bytes + value_bytes
-                self.__file.write(header)
-                self.__file.flush()
-                self.__store[key] = (offset, True)
-                self.__logger.info(f"Set key '{key}' successfully")
-                return True
-            except Exception as e:
-                self.__logger.error(f"Error setting key '{key}': {e}")
-                return False
-            finally:
-                self.__unlock_file(self.__file)
+        try:
+            key_bytes = self.__encode_key(key)
+            value_bytes = value.encode()
+            self.__submit(key_bytes, value_bytes, True)
+            self.__logger.info("Set key '%s' successfully", key)
+            return True
+        except Exception as e:
+            self.__logger.error("Error setting key '%s': %s", key, e)
+            return False
 
     def get(self, key: str) -> bytes | None:
         """
         Retrieves the value associated with the given key from the key-value store.
 
-        - Checks if the key exists in the in-memory store and is set.
-        - Acquires a shared file lock to allow concurrent reads.
-        - Seeks to the offset in the log file where the key-value pair is stored.
-        - Reads and unpacks the header to get key and value lengths.
-        - Reads the key and value bytes from the log file.
-        - Verifies the key matches the requested key.
+        - Holds the readers-writer lock for reading, so gets never block each other.
+        - Encodes the key once, through the key encoding cache.
+        - Returns a value kept inline (no larger than INLINE_THRESHOLD bytes) without touching the log.
+        - Otherwise checks if the encoded key exists in the in-memory store and its entry has SET_BIT set.
+        - Unpacks the header at the key's offset in the memory-mapped log to get key and value lengths,
+          and slices the key and value bytes out of the mapping, without any file lock or read call.
+        - Records written after the log was mapped are read with os.pread on the already open log file.
+        - Verifies the stored key bytes match the cached encoding of the requested key, without decoding them.
         - Returns the value bytes if found, otherwise logs an error or warning.
 
         Args:
@@ -217,45 +975,42 @@ class WriteAheadStore(BaseStore):
         if not isinstance(key, str) or not key:
             self.__logger.error("Key must be a non-empty string")
             raise ValueError("Key must be a non-empty string")
-        if key not in self.__store:
-            self.__logger.warning(f"Key '{key}' not found")
-            return None
-        offset, is_set = self.__store[key]
-        if not is_set:
-            self.__logger.warning(f"Key '{key}' is not set")
-            return None
-        with open(self.__write_ahead_log_file_path, "rb") as log_file:
-            try:
-                self.__lock_file(log_file,LOCK_STATE.SHARED)
-                log_file.seek(offset)
-                header = log_file.read(12)
-                _, key_length, value_length = struct.unpack("III", header)
-                key_bytes = log_file.read(key_length)
-                value_bytes = log_file.read(value_length)
-                key_decode = key_bytes.decode()
-                if key_decode == key:
-                    return value_bytes
-                self.__logger.error(f"Key mismatch at offset {offset}: expected {key}, found {key_decode}")
+        self.__rw_lock.acquire_read()
+        try:
+            key_bytes = self.__encode_key(key)
+            value_bytes = self.__inline_values.get(key_bytes)
+            if value_bytes is not None:
+                return value_bytes
+            entry = self.__store.get(key_bytes)
+            if entry is None:
+                self.__logger.warning("Key '%s' not found", key)
                 return None
-            except Exception as e:
-                self.__logger.error(f"Error getting key '{key}': {e}")
+            if not entry & SET_BIT:
+                self.__logger.warning("Key '%s' is not set", key)
                 return None
-            finally:
-                self.__unlock_file(log_file)
+            offset = entry & ~SET_BIT
+            found_key_bytes, value_bytes = self.__read_record(offset, len(key_bytes))
+            if found_key_bytes == key_bytes:
+                return value_bytes
+            self.__logger.error("Key mismatch at offset %s: expected %s, found %s", offset, key, found_key_bytes.decode(errors='replace'))
+            return None
+        except Exception as e:
+            self.__logger.error("Error getting key '%s': %s", key, e)
+            return None
+        finally:
+            self.__rw_lock.release_read()
 
     def delete(self, key: str) -> bool:
         """
         Deletes the given key from the key-value store.
 
-        - Acquires a thread lock to ensure thread-safe operation.
-        - Acquires an exclusive file lock to prevent concurrent writes.
-        - Encodes the key as bytes.
-        - Packs a header with the current timestamp, key length, and a value length of 0 (indicating deletion).
-        - Writes the header and key to the write-ahead log.
-        - Updates the in-memory store with the key, its offset, and delete status.
+        - Encodes the key as bytes, through the key encoding cache.
+        - Packs a header with the next sequence number, key length, and a value length of 0 (indicating deletion)
+          in place in the pending batch buffer, and copies the key after it.
+        - The background flusher writes the record to the write-ahead log together with the other pending records.
+        - Once written, the in-memory store maps the key to its offset without SET_BIT (deleted).
         - Logs the operation and returns True on success.
         - Handles exceptions by logging errors and returns False on failure.
-        - Always releases the file lock in a finally block.
 
         Args:
             key (str): The key to delete.
@@ -266,21 +1021,12 @@ class WriteAheadStore(BaseStore):
         if not isinstance(key, str) or not key:
             self.__logger.error("Key must be a non-empty string")
             raise ValueError("Key must be a non-empty string")
-        with self.__thread_lock:
-            try:
-                self.__lock_file(self.__file,LOCK_STATE.EXCLUSIVE)
-                offset = self.__file.tell()
-                key_bytes = key.encode()
-                header = struct.pack("III", int(time.time()), len(key_bytes), 0)
-                header += key_bytes
-                self.__file.write(header)
-                self.__file.flush()
-                self.__store[key] = (offset, False)
-                self.__logger.info(f"Deleted key '{key}' successfully")
-                return True
-            except Exception as e:
-                self.__logger.error(f"Error deleting key '{key}': {e}")
-                return False
-            finally:
-                self.__unlock_file(self.__file)
+        try:
+            key_bytes = self.__encode_key(key)
+            self.__submit(key_bytes, b"", False)
+            self.__logger.info("Deleted key '%s' successfully", key)
+            return True
+        except Exception as e:
+            self.__logger.error("Error deleting key '%s': %s", key, e)
+            return False
 